@@ -1,17 +1,56 @@
+import atexit
 import logging
 import logging.handlers
+import os
 from pathlib import Path
+import queue
 import sys
+from typing import Optional
 
 
-LEVEL = logging.DEBUG
+LEVEL = logging.DEBUG if os.environ.get("SM_DEBUG") == "1" else logging.INFO
+
+LOG_FILE_MAX_BYTES = 8 * 1024 * 1024
+
+_FORMATTER = logging.Formatter(fmt="%(asctime)s [%(levelname)s] %(message)s")
+
+_listeners: dict[str, logging.handlers.QueueListener] = {}
 
 
 def get_logger() -> logging.Logger:
     return logging.getLogger()
 
 
+def _attach_queue_listener(
+    logger: logging.Logger, key: str, *handlers: logging.Handler
+) -> None:
+    """Make `logger` only enqueue records, handlers are run by a listener thread."""
+    previous: Optional[logging.handlers.QueueListener] = _listeners.pop(key, None)
+    if previous is not None:
+        previous.stop()
+
+    record_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        record_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    _listeners[key] = listener
+
+    logger.addHandler(logging.handlers.QueueHandler(record_queue))
+
+
+@atexit.register
+def _stop_queue_listeners() -> None:
+    for listener in _listeners.values():
+        listener.stop()
+    _listeners.clear()
+
+
 def configure_host_logger() -> None:
+    if "host" in _listeners:
+        # Already configured, avoid reopening log files on script reruns.
+        return
+
     host_log_directory = Path.cwd() / "log" / "host"
     host_log_directory.mkdir(exist_ok=True, parents=True)
 
@@ -19,25 +58,20 @@ def configure_host_logger() -> None:
     logger.handlers.clear()
     logger.setLevel(LEVEL)
 
-    handler = logging.handlers.TimedRotatingFileHandler(
+    handler = logging.handlers.RotatingFileHandler(
         filename=host_log_directory / "host.log",
-        when="h",
-        interval=2,
+        maxBytes=LOG_FILE_MAX_BYTES,
         backupCount=72,
+        delay=True,
     )
     handler.setLevel(LEVEL)
-    handler.setFormatter(
-        logging.Formatter(fmt="%(asctime)s [%(levelname)s] %(message)s")
-    )
-
-    logger.addHandler(handler)
+    handler.setFormatter(_FORMATTER)
 
     handler2 = logging.StreamHandler(stream=sys.stderr)
     handler2.setLevel(logging.WARNING)
-    handler2.setFormatter(
-        logging.Formatter(fmt="%(asctime)s [%(levelname)s] %(message)s")
-    )
-    logger.addHandler(handler2)
+    handler2.setFormatter(_FORMATTER)
+
+    _attach_queue_listener(logger, "host", handler, handler2)
 
 
 def configure_vm_logger(name: str) -> logging.Logger:
@@ -48,17 +82,15 @@ def configure_vm_logger(name: str) -> logging.Logger:
     logger.handlers.clear()
     logger.setLevel(LEVEL)
 
-    handler = logging.handlers.TimedRotatingFileHandler(
+    handler = logging.handlers.RotatingFileHandler(
         filename=host_log_directory / "vm.log",
-        when="h",
-        interval=2,
+        maxBytes=LOG_FILE_MAX_BYTES,
         backupCount=72,
+        delay=True,
     )
     handler.setLevel(LEVEL)
-    handler.setFormatter(
-        logging.Formatter(fmt="%(asctime)s [%(levelname)s] %(message)s")
-    )
+    handler.setFormatter(_FORMATTER)
 
-    logger.addHandler(handler)
+    _attach_queue_listener(logger, f"vm/{name}", handler)
 
     return logger
@@ -1,14 +1,20 @@
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
 import getpass
 import hmac
+import logging
+import os
 from pathlib import Path
 import platform
 from pprint import pformat
+import signal
 import subprocess
 import sys
-import time
-from typing import Optional
+from typing import Callable, Optional
 from attr import dataclass
+import numpy
 import pandas
 import streamlit
 import streamlit.delta_generator
@@ -27,7 +33,28 @@ logger.info(f"Python executable: {sys.executable}")
 logger.info(platform.platform())
 logger.info(pformat(sys.argv))
 
-vbox = VBoxManage()
+# Kept just below the 5 second fragment cadence so that every fragment tick
+# still sees fresh state, while renders within the same tick share one reload.
+VM_INFO_TTL_SECONDS = 4.0
+
+
+@streamlit.cache_resource
+def _get_vbox() -> VBoxManage:
+    # Survives module re-execution, which would otherwise start another
+    # metric daemon thread.
+    return VBoxManage(info_ttl_seconds=VM_INFO_TTL_SECONDS)
+
+
+vbox = _get_vbox()
+
+# Secrets do not change while the app is running, so the password is read once.
+_PASSWORD: bytes = (streamlit.secrets["password"] or "").encode("utf-8")
+
+VM_LIST_TTL_SECONDS = 30
+
+# VM control actions run here, so that button callbacks do not block the
+# script thread while VBoxManage is working.
+_action_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vm_action")
 
 
 def main():
@@ -47,13 +74,21 @@ def main():
 def virtualbox_manager_tab(tab: streamlit.delta_generator.DeltaGenerator) -> None:
     tab.write("Virtual Machines List")
 
-    for vm in vbox.list_vm():
-        virtualbox_manager_tab_virtual_machine(tab.empty(), vm)
+    virtual_machines = _cached_vm_list()
+    vbox.prefetch_info(virtual_machines)
 
+    for vm in virtual_machines:
+        virtualbox_manager_tab_virtual_machine(tab, vm)
 
-def virtualbox_manager_tab_virtual_machine(tab, vm: VirtualMachine):
-    vm.info.reload()
 
+@streamlit.cache_resource(ttl=VM_LIST_TTL_SECONDS, show_spinner=False)
+def _cached_vm_list() -> list[VirtualMachine]:
+    return list(vbox.list_vm())
+
+
+def virtualbox_manager_tab_virtual_machine(
+    tab: streamlit.delta_generator.DeltaGenerator, vm: VirtualMachine
+) -> None:
     with tab.expander(f"🖥 **{vm.name}**  `{vm.info.system}`  `{vm.id}`"):
         vm_status_tab, vm_info_tab = streamlit.tabs(["Status", "Info"])
         virtualbox_manager_status_tab(vm_status_tab, vm)
@@ -68,34 +103,61 @@ def virtualbox_manager_status_tab(
 ) -> None:
     inner = container.container()
 
-    _vm_status_message(inner.empty(), vm)
+    status_message = inner.empty()
 
     _vm_control_buttons(inner.empty(), vm)
 
+    cpu_user_plot = inner.empty()
+    cpu_kernel_plot = inner.empty()
+    ram_plot = inner.empty()
+
+    _vm_status_tick(status_message, cpu_user_plot, cpu_kernel_plot, ram_plot, vm)
+
+
+@streamlit.fragment(run_every=5)
+def _vm_status_tick(
+    status_message: streamlit.delta_generator.DeltaGenerator,
+    cpu_user_plot: streamlit.delta_generator.DeltaGenerator,
+    cpu_kernel_plot: streamlit.delta_generator.DeltaGenerator,
+    ram_plot: streamlit.delta_generator.DeltaGenerator,
+    vm: VirtualMachine,
+) -> None:
+    """Refresh VM status and all metric plots in a single fragment run."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Reloading '%s' status and metrics.", vm.name)
+
+    _vm_status_message(status_message, vm)
+
+    x_values = numpy.asarray(vm.get_metric_history("time_stamp"), dtype=numpy.float64)
+
     virtualbox_manager_metric_plot(
-        inner.empty(), vm, Metrics.GUEST_CPU_LOAD_USER, "CPU % (user)"
+        cpu_user_plot, vm, x_values, Metrics.GUEST_CPU_LOAD_USER, "CPU % (user)"
     )
     virtualbox_manager_metric_plot(
-        inner.empty(), vm, Metrics.GUEST_CPU_LOAD_KERNEL, "CPU % (kernel)"
+        cpu_kernel_plot, vm, x_values, Metrics.GUEST_CPU_LOAD_KERNEL, "CPU % (kernel)"
     )
-    virtualbox_manager_metric_plot_ram(inner.empty(), vm)
+    virtualbox_manager_metric_plot_ram(ram_plot, vm, x_values)
+
+
+# Container method name and message displayed for given VM state.
+VM_STATUS_MESSAGES: dict[VMState, tuple[str, str]] = {
+    VMState.Running: ("success", "🟢 Running"),
+    VMState.PowerOff: ("error", "🔴 Power Off"),
+    VMState.Paused: ("info", "🔵 Paused"),
+    VMState.Saved: ("info", "💾 Saved"),
+}
 
 
-@streamlit.fragment(run_every=5)
 def _vm_status_message(
     container: streamlit.delta_generator.DeltaGenerator, vm: VirtualMachine
 ) -> None:
-    logger.debug("Reloading '%s' status.", vm.name)
-
-    vm.info.reload()
+    _resolve_vm_action(vm)
     status = vm.info.state
 
-    {
-        VMState.Running: lambda: container.success("🟢 Running"),
-        VMState.PowerOff: lambda: container.error("🔴 Power Off"),
-        VMState.Paused: lambda: container.info("🔵 Paused"),
-        VMState.Saved: lambda: container.info("💾 Saved"),
-    }.get(status, lambda: container.warning(f"⚠️ {status.name}"))()
+    method_name, message = VM_STATUS_MESSAGES.get(
+        status, ("warning", f"⚠️ {status.name}")
+    )
+    getattr(container, method_name)(message)
 
 
 def _vm_control_buttons(
@@ -108,14 +170,13 @@ def _vm_control_buttons(
 
     def _start():
         streamlit.toast(f"🔵 Starting `{vm.name}`...")
-        vm.start()
-
-        time.sleep(1)
-        vm.info.reload()
-        if vm.info.state == VMState.Running:
-            streamlit.toast(f"🟢 Started `{vm.name}`...")
-        else:
-            streamlit.toast(f"⛔ Failed to start `{vm.name}`...")
+        _dispatch_vm_action(
+            vm,
+            vm.start,
+            VMState.Running,
+            f"🟢 Started `{vm.name}`...",
+            f"⛔ Failed to start `{vm.name}`...",
+        )
 
     start.button(
         "🟢 Start", on_click=_start, key=f"start_{vm.id}", use_container_width=True
@@ -123,14 +184,13 @@ def _vm_control_buttons(
 
     def _shutdown():
         streamlit.toast(f"🔵 Shutting down `{vm.name}`...")
-        vm.shutdown()
-
-        time.sleep(1)
-        vm.info.reload()
-        if vm.info.state == VMState.PowerOff:
-            streamlit.toast(f"🔴 Shut down `{vm.name}`...")
-        else:
-            streamlit.toast(f"⛔ Failed to shut down `{vm.name}`...")
+        _dispatch_vm_action(
+            vm,
+            vm.shutdown,
+            VMState.PowerOff,
+            f"🔴 Shut down `{vm.name}`...",
+            f"⛔ Failed to shut down `{vm.name}`...",
+        )
 
     shutdown.button(
         "🔴 Shutdown",
@@ -141,14 +201,13 @@ def _vm_control_buttons(
 
     def _kill():
         streamlit.toast(f"💀 Killing `{vm.name}`...")
-        vm.kill()
-
-        time.sleep(1)
-        vm.info.reload()
-        if vm.info.state == VMState.PowerOff:
-            streamlit.toast(f"💀 Killed `{vm.name}`...")
-        else:
-            streamlit.toast(f"⛔ Failed to kill `{vm.name}`...")
+        _dispatch_vm_action(
+            vm,
+            vm.kill,
+            VMState.PowerOff,
+            f"💀 Killed `{vm.name}`...",
+            f"⛔ Failed to kill `{vm.name}`...",
+        )
 
     kill.button(
         "💀 Kill", on_click=_kill, key=f"kill_{vm.id}", use_container_width=True
@@ -158,14 +217,13 @@ def _vm_control_buttons(
 
     def _pause():
         streamlit.toast(f"🔵 Pausing `{vm.name}`...")
-        vm.pause()
-
-        time.sleep(1)
-        vm.info.reload()
-        if vm.info.state == VMState.Paused:
-            streamlit.toast(f"🔵 Paused `{vm.name}`...")
-        else:
-            streamlit.toast(f"⛔ Failed to pause `{vm.name}`...")
+        _dispatch_vm_action(
+            vm,
+            vm.pause,
+            VMState.Paused,
+            f"🔵 Paused `{vm.name}`...",
+            f"⛔ Failed to pause `{vm.name}`...",
+        )
 
     pause.button(
         "🔵 Pause", on_click=_pause, key=f"pause_{vm.id}", use_container_width=True
@@ -173,14 +231,13 @@ def _vm_control_buttons(
 
     def _save():
         streamlit.toast(f"🔵 Saving `{vm.name}`...")
-        vm.save()
-        time.sleep(1)
-
-        vm.info.reload()
-        if vm.info.state == VMState.Saved:
-            streamlit.toast(f"🔵 Saved `{vm.name}`...")
-        else:
-            streamlit.toast(f"⛔ Failed to save `{vm.name}`...")
+        _dispatch_vm_action(
+            vm,
+            vm.save,
+            VMState.Saved,
+            f"🔵 Saved `{vm.name}`...",
+            f"⛔ Failed to save `{vm.name}`...",
+        )
 
     save.button(
         "💾 Save", on_click=_save, key=f"save_{vm.id}", use_container_width=True
@@ -188,75 +245,134 @@ def _vm_control_buttons(
 
     def _resume():
         streamlit.toast(f"🟢 Resuming `{vm.name}`...")
-        vm.resume()
-        time.sleep(1)
-
-        vm.info.reload()
-        if vm.info.state == VMState.Running:
-            streamlit.toast(f"🟢 Resumed `{vm.name}`...")
-        else:
-            streamlit.toast(f"⛔ Failed to resume `{vm.name}`...")
+        _dispatch_vm_action(
+            vm,
+            vm.resume,
+            VMState.Running,
+            f"🟢 Resumed `{vm.name}`...",
+            f"⛔ Failed to resume `{vm.name}`...",
+        )
 
     resume.button(
         "🟢 Resume", on_click=_resume, key=f"resume_{vm.id}", use_container_width=True
     )
 
 
-@streamlit.fragment(run_every=5)
+@dataclass
+class PendingAction:
+
+    future: Future[None]
+    expected_state: VMState
+    success_message: str
+    failure_message: str
+
+
+def _dispatch_vm_action(
+    vm: VirtualMachine,
+    action: Callable[[], None],
+    expected_state: VMState,
+    success_message: str,
+    failure_message: str,
+) -> None:
+    streamlit.session_state[f"action_{vm.id}"] = PendingAction(
+        future=_action_executor.submit(action),
+        expected_state=expected_state,
+        success_message=success_message,
+        failure_message=failure_message,
+    )
+
+
+def _resolve_vm_action(vm: VirtualMachine) -> None:
+    """Report outcome of VM action once it has finished."""
+    key = f"action_{vm.id}"
+    action = streamlit.session_state.get(key)
+    if action is None or not action.future.done():
+        return
+
+    del streamlit.session_state[key]
+
+    # Bypass the info cache TTL, but still load info only once.
+    info = vm.manage.get_info(vm, force=True)
+    if action.future.exception() is None and info.state == action.expected_state:
+        streamlit.toast(action.success_message)
+    else:
+        streamlit.toast(action.failure_message)
+
+
+def _history_frame(
+    x_name: str, x_values: numpy.ndarray, y_name: str, y_values: numpy.ndarray
+) -> pandas.DataFrame:
+    """Wrap float64 history arrays in a data frame without copying them."""
+    return pandas.DataFrame({x_name: x_values, y_name: y_values}, copy=False)
+
+
 def virtualbox_manager_metric_plot(
     container: streamlit.delta_generator.DeltaGenerator,
     vm: VirtualMachine,
+    x_values: numpy.ndarray,
     metric: Metrics,
     y_name: str,
 ):
-    logger.debug("Reloading '%s' metric '%s' plot.", vm.name, metric.value)
-
-    x_values = vm.get_metric_history("time_stamp")
-    y_values = vm.get_metric_history(metric)
+    y_values = numpy.asarray(vm.get_metric_history(metric), dtype=numpy.float64)
 
     x_name = "Time"
-    df = pandas.DataFrame({x_name: x_values, y_name: y_values})
+    df = _history_frame(x_name, x_values, y_name, y_values)
+
+    chart = _percent_chart_template(x_name, y_name).properties(data=df)
+    container.altair_chart(chart, use_container_width=True)
 
-    chart = (
-        altair.Chart(df, title=y_name, height=300)
+
+@streamlit.cache_resource(show_spinner=False)
+def _percent_chart_template(x_name: str, y_name: str) -> altair.Chart:
+    """Build chart spec once, plots only swap in new data with `properties()`."""
+    return (
+        altair.Chart(title=y_name, height=300)
         .mark_line()
         .encode(
             x=altair.X(x_name),
             y=altair.Y(y_name).scale(domain=(0, 100)),
         )
     )
-    container.altair_chart(chart, use_container_width=True)
 
 
-@streamlit.fragment(run_every=5)
 def virtualbox_manager_metric_plot_ram(
     container: streamlit.delta_generator.DeltaGenerator,
     vm: VirtualMachine,
+    x_values: numpy.ndarray,
 ):
-    logger.debug("Reloading '%s' RAM usage plot.")
-
-    x_values = vm.get_metric_history("time_stamp")
-    y_values = [
-        (total - free) / (1024 * 1024)
-        for (total, free) in zip(
-            vm.get_metric_history(Metrics.GUEST_RAM_USAGE_TOTAL),
-            vm.get_metric_history(Metrics.GUEST_RAM_USAGE_FREE),
-        )
-    ]
+    # Histories are padded with NaN until samples arrive, hence float arrays.
+    total = numpy.asarray(
+        vm.get_metric_history(Metrics.GUEST_RAM_USAGE_TOTAL), dtype=numpy.float64
+    )
+    free = numpy.asarray(
+        vm.get_metric_history(Metrics.GUEST_RAM_USAGE_FREE), dtype=numpy.float64
+    )
+    y_values = numpy.subtract(total, free) * (1.0 / (1024 * 1024))
 
     x_name = "Time"
     y_name = "RAM (MB)"
-    df = pandas.DataFrame({x_name: x_values, y_name: y_values})
+    df = _history_frame(x_name, x_values, y_name, y_values)
 
-    chart = (
-        altair.Chart(df, title=y_name, height=300)
-        .mark_line()
-        .encode(
-            x=altair.X(x_name),
-            y=altair.Y(y_name),
-        )
+    container.line_chart(
+        df, x=x_name, y=y_name, height=300, use_container_width=True
+    )
+
+
+COMMAND_OUTPUT_MAX_BYTES = 64 * 1024
+COMMAND_HISTORY_MAX_LENGTH = 200
+# User and working directory of the server process do not change at runtime.
+COMMAND_PLACEHOLDER = f"$ ({getpass.getuser()}) {Path.cwd().as_posix()}"
+
+
+def _decode_command_output(data: bytes) -> str:
+    """Decode command output, truncated to keep session state and page small."""
+    if len(data) <= COMMAND_OUTPUT_MAX_BYTES:
+        return data.decode("utf-8", errors="replace")
+
+    return (
+        data[:COMMAND_OUTPUT_MAX_BYTES].decode("utf-8", errors="replace")
+        + "\n…(truncated)"
     )
-    container.altair_chart(chart, use_container_width=True)
 
 
 @dataclass
@@ -269,6 +385,12 @@ class CommandResult:
     is_timeout: bool
 
 
+def _command_history() -> deque[CommandResult]:
+    return streamlit.session_state.setdefault(
+        "host_command_results", deque(maxlen=COMMAND_HISTORY_MAX_LENGTH)
+    )
+
+
 def server_console_tab(tab: streamlit.delta_generator.DeltaGenerator) -> None:
     tab.write("Server Console")
     tab.container()
@@ -280,46 +402,47 @@ def server_console_tab(tab: streamlit.delta_generator.DeltaGenerator) -> None:
     )
     command_string = tab.text_input(
         "Command",
-        placeholder=f"$ ({getpass.getuser()}) {Path.cwd().as_posix()}",
-        on_change=print(),
+        placeholder=COMMAND_PLACEHOLDER,
         key="command",
     )
     if command_string:
+        process = subprocess.Popen(
+            command_string,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # Run in a new process group, so that on timeout we can kill the
+            # shell together with everything it spawned.
+            start_new_session=True,
+        )
         try:
-            result = subprocess.run(
-                command_string,
-                shell=True,
-                capture_output=True,
+            stdout, stderr = process.communicate(
                 timeout=streamlit.session_state.get("command_timeout_seconds", 3600),
             )
-        except subprocess.TimeoutExpired as e:
-            host_command_results = streamlit.session_state.get(
-                "host_command_results", []
-            )
-            host_command_results.insert(
-                0,
+        except subprocess.TimeoutExpired:
+            with suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+            stdout, stderr = process.communicate()
+
+            _command_history().appendleft(
                 CommandResult(
                     command=command_string,
                     return_code=None,
-                    stdout=e.stdout.decode("utf-8") if e.stdout else "",
-                    stderr=e.stderr.decode("utf-8") if e.stderr else "",
+                    stdout=_decode_command_output(stdout),
+                    stderr=_decode_command_output(stderr),
                     is_timeout=True,
                 ),
             )
-            streamlit.session_state["host_command_results"] = host_command_results
-
-        host_command_results = streamlit.session_state.get("host_command_results", [])
-        host_command_results.insert(
-            0,
-            CommandResult(
-                command=result.args,
-                return_code=result.returncode,
-                stdout=result.stdout.decode("utf-8"),
-                stderr=result.stderr.decode("utf-8"),
-                is_timeout=False,
-            ),
-        )
-        streamlit.session_state["host_command_results"] = host_command_results
+        else:
+            _command_history().appendleft(
+                CommandResult(
+                    command=command_string,
+                    return_code=process.returncode,
+                    stdout=_decode_command_output(stdout),
+                    stderr=_decode_command_output(stderr),
+                    is_timeout=False,
+                ),
+            )
 
     command_timeout_seconds = tab.number_input(
         "Timeout (seconds)", value=3600, min_value=0
@@ -327,11 +450,16 @@ def server_console_tab(tab: streamlit.delta_generator.DeltaGenerator) -> None:
     if command_timeout_seconds:
         streamlit.session_state["command_timeout_seconds"] = command_timeout_seconds
 
-    command_log_container = tab.container()
+    _render_command_history(tab.container())
+
 
+@streamlit.fragment
+def _render_command_history(
+    container: streamlit.delta_generator.DeltaGenerator,
+) -> None:
     for result in streamlit.session_state.get("host_command_results", []):
         assert isinstance(result, CommandResult)
-        with command_log_container.expander(
+        with container.expander(
             f"[**`{result.return_code}`**] {'[timeout]' if result.is_timeout else ''} `{result.command}`"
         ):
             streamlit.subheader("Command")
@@ -346,23 +474,23 @@ def server_console_tab(tab: streamlit.delta_generator.DeltaGenerator) -> None:
 
 def check_password():
     """Returns `True` if the user had the correct password."""
-    if not streamlit.secrets["password"]:
+    # Return True if the password is validated.
+    if streamlit.session_state.get("password_correct", False):
+        return True
+
+    if not _PASSWORD:
         return True
 
     def password_entered():
         """Checks whether a password entered by the user is correct."""
         if hmac.compare_digest(
-            streamlit.session_state["password"], streamlit.secrets["password"]
+            streamlit.session_state["password"].encode("utf-8"), _PASSWORD
         ):
             streamlit.session_state["password_correct"] = True
             del streamlit.session_state["password"]  # Don't store the password.
         else:
             streamlit.session_state["password_correct"] = False
 
-    # Return True if the password is validated.
-    if streamlit.session_state.get("password_correct", False):
-        return True
-
     # Show input for password.
     streamlit.text_input(
         "Password", type="password", on_change=password_entered, key="password"
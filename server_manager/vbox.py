@@ -1,7 +1,9 @@
 from __future__ import annotations
-from contextlib import contextmanager, suppress
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from enum import Enum
-from functools import cached_property
+from functools import lru_cache
 import json
 from pathlib import Path
 import re
@@ -9,11 +11,7 @@ from subprocess import CompletedProcess
 import subprocess
 import threading
 import time
-from typing import Any, Callable, Generator, TypeVar
-
-from altair import Literal
-import numpy
-import pydantic
+from typing import Any, Callable, Generator, Literal, NamedTuple, TypeVar
 
 
 class Metrics(Enum):
@@ -26,6 +24,24 @@ class Metrics(Enum):
     GUEST_RAM_USAGE_CACHE = "Guest/RAM/Usage/Cache"
 
 
+# Matches a `list vms` output row: `"<name>" {<uuid>}`.
+_VM_LINE_RE = re.compile(rb'^"(.+)" \{([^}]+)\}', re.MULTILINE)
+
+# Match single values of `showvminfo --machinereadable` output.
+_VM_STATE_RE = re.compile(rb'^VMState="([^"]*)"', re.MULTILINE)
+_VM_OSTYPE_RE = re.compile(rb'^ostype="([^"]*)"', re.MULTILINE)
+
+# Matches a `metrics query` output row: object (VM name), metric and value.
+# Aggregate rows, eg. `Guest/CPU/Load/User:avg`, are not matched. Whitespace
+# is `[^\S\n]` so that a row without value never swallows the next line.
+_METRIC_QUERY_LINE_RE = re.compile(
+    rb"^(?P<object>.+?)[^\S\n]+(?P<metric>"
+    + b"|".join(re.escape(metric.value.encode()) for metric in Metrics)
+    + rb")(?:[^\S\n]+(?P<value>.*?))?[^\S\n]*$",
+    re.MULTILINE,
+)
+
+
 T = TypeVar("T")
 
 
@@ -45,7 +61,7 @@ class VMState(Enum):
         return VMState.Other
 
 
-class UserInfo(pydantic.BaseModel):
+class UserInfo(NamedTuple):
     username: str
     password: str
     is_admin: bool
@@ -62,31 +78,42 @@ class VirtualMachine:
     def users(self) -> list[UserInfo]:
         return self.manage.user_info.get(self.id, [])
 
-    @cached_property
+    @property
     def info(self) -> VirtualMachineInfo:
-        return VirtualMachineInfo(vm=self)
+        return self.manage.get_info(self)
 
     def query_metric(self, name: str, converter: Callable[[str], T] = str) -> T:
-        result = self.manage.run("metrics", "query", self.id, name)
-        stdout = result.stdout.decode()
-        metric_name_index = stdout.find(name)
-        if metric_name_index == -1:
-            return converter("nan")
-
-        # Find end of line which contains the metric value.
-        end_of_line_index = stdout.find("\n", metric_name_index)
-
-        line_with_metric_name = stdout[metric_name_index:end_of_line_index]
-
-        data = line_with_metric_name.replace(name, "").strip()
-        if len(data) == 0:
-            return converter("nan")
-
-        return converter(data)
+        return converter(self.query_metrics([name]).get(name, "nan"))
+
+    def is_running(self) -> bool:
+        return self.info.is_running
+
+    def query_metrics(self, names: list[str]) -> dict[str, str]:
+        """Query multiple metrics with single VBoxManage call.
+
+        Returns raw values keyed by metric name, metrics without value are omitted.
+        """
+        result = self.manage.run("metrics", "query", self.id, ",".join(names))
+        wanted = {name.encode(): name for name in names}
+        values: dict[str, str] = {}
+
+        # Output is scanned as bytes, only matched values are decoded.
+        for line in result.stdout.splitlines():
+            # Row is `<object> <metric> <value>`, object name may contain spaces.
+            fields = line.split()
+            for index, field in enumerate(fields):
+                name = wanted.get(field)
+                if name is not None:
+                    value = b" ".join(fields[index + 1 :])
+                    if value:
+                        values.setdefault(name, value.decode())
+                    break
+
+        return values
 
     def get_metric_history(
         self, metric: Metrics | Literal["time_stamp"]
-    ) -> list[float]:
+    ) -> array[float]:
         return self.manage.metric_daemon.get_metric_history(self, metric)
 
     def guest_control_run(
@@ -133,48 +160,93 @@ class VirtualMachineInfo:
     def __init__(self, vm: VirtualMachine) -> None:
         self.vm = vm
         self.manage = vm.manage
-        self._info: dict[str, str] = {}
+        self._output = b""
+        self._info: dict[str, str] | None = None
+        self.loaded_at = 0.0
         self.reload()
 
     def reload(self) -> None:
         result = self._run("showvminfo", self.vm.id, "--machinereadable")
-
-        def _() -> Generator[tuple[str, str], None, None]:
-            for line in result.stdout.decode().splitlines():
-                if "=" not in line:
-                    continue
-                key, value = line.split("=", 1)
-                key = key.strip('"')
-                value = value.strip('"')
-                yield key, value
-
-        self._info = dict(_())
+        self.loaded_at = time.monotonic()
+        self._output = result.stdout
+        # Parsed on first use, status checks only need `state`.
+        self._info = None
 
     def _run(self, *args: str, **kwargs: Any) -> CompletedProcess[bytes]:
         return self.manage.run(*args, **kwargs)
 
+    @property
+    def _parsed(self) -> dict[str, str]:
+        if self._info is None:
+
+            def _() -> Generator[tuple[str, str], None, None]:
+                for line in self._output.decode().splitlines():
+                    key, separator, value = line.partition("=")
+                    if not separator:
+                        continue
+                    yield _unquote(key), _unquote(value)
+
+            self._info = dict(_())
+
+        return self._info
+
+    def _find(self, pattern: re.Pattern[bytes]) -> str | None:
+        match = pattern.search(self._output)
+        return match[1].decode() if match else None
+
     @property
     def state(self) -> VMState:
-        return VMState(self._info.get("VMState", "").casefold())
+        return VMState((self._find(_VM_STATE_RE) or "").casefold())
 
     @property
     def system(self) -> str:
-        return self._info.get("ostype", "<unknown>")
+        return self._find(_VM_OSTYPE_RE) or "<unknown>"
+
+    @property
+    def is_running(self) -> bool:
+        # VMState is never the first line, `name` always precedes it.
+        return b'\nVMState="running"' in self._output
 
     def items(self) -> Generator[tuple[str, str], None, None]:
-        yield from self._info.items()
+        yield from self._parsed.items()
 
     def __getitem__(self, key: str) -> Any:
-        return self._info[key]
+        return self._parsed[key]
 
     def get(self, key: str, default: Any = None) -> Any:
-        return self._info.get(key, default)
+        return self._parsed.get(key, default)
+
+
+def _unquote(string: str) -> str:
+    if len(string) >= 2 and string[0] == '"' and string[-1] == '"':
+        return string[1:-1]
+    return string
+
+
+@lru_cache(maxsize=4)
+def _load_user_info_file(path: str, _mtime_ns: int) -> dict[str, list[UserInfo]]:
+    # Modification time is part of the cache key, so edited files are re-read.
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {
+        vm_name: [UserInfo(**value) for value in user_info_list]
+        for vm_name, user_info_list in data.items()
+    }
 
 
 class VBoxManage:
 
-    def __init__(self, executable: Path = Path("/usr/bin/vboxmanage")) -> None:
+    def __init__(
+        self,
+        executable: Path = Path("/usr/bin/vboxmanage"),
+        info_ttl_seconds: float = 1.0,
+    ) -> None:
         self.executable = executable
+        self._executable_path = executable.as_posix()
+        self.info_ttl_seconds = info_ttl_seconds
+        self._info_cache: dict[str, VirtualMachineInfo] = {}
+        self._info_executor = ThreadPoolExecutor(
+            max_workers=8, thread_name_prefix="vm_info"
+        )
         self.metric_daemon = VboxMetricDaemon(self)
         self.user_info = self._load_user_info()
 
@@ -186,12 +258,11 @@ class VBoxManage:
             Path.cwd() / file_name,
             server_manager_config / file_name,
         ]:
-            if path.exists():
-                data = json.loads(path.read_text(encoding="utf-8"))
-                return {
-                    vm_name: [UserInfo(**value) for value in user_info_list]
-                    for vm_name, user_info_list in data.items()
-                }
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            return _load_user_info_file(path.as_posix(), stat.st_mtime_ns)
 
         server_manager_config.mkdir(parents=True, exist_ok=True)
         (server_manager_config / file_name).write_text("{}")
@@ -202,24 +273,51 @@ class VBoxManage:
         self, *args: str, capture_output: bool = True, **kwargs: Any
     ) -> CompletedProcess[bytes]:
         return subprocess.run(
-            [self.executable.as_posix(), *args],
-            executable=self.executable.as_posix(),
+            [self._executable_path, *args],
+            executable=self._executable_path,
             capture_output=capture_output,
             **kwargs,
         )
 
+    def get_info(self, vm: VirtualMachine, force: bool = False) -> VirtualMachineInfo:
+        """Return info of given VM, reloaded when older than `info_ttl_seconds`.
+
+        Info is shared by all `VirtualMachine` objects with the same id. With
+        `force` cached info is reloaded regardless of its age.
+        """
+        info = self._info_cache.get(vm.id)
+        if info is None:
+            info = self._info_cache[vm.id] = VirtualMachineInfo(vm=vm)
+        elif force or time.monotonic() - info.loaded_at >= self.info_ttl_seconds:
+            info.reload()
+        return info
+
+    def prefetch_info(self, vms: list[VirtualMachine]) -> None:
+        """Reload stale info of multiple VMs with concurrent VBoxManage calls."""
+        list(self._info_executor.map(self.get_info, vms))
+
     def list_vm(self) -> Generator[VirtualMachine, None, None]:
-        result = self.run("list", "vms")
+        yield from self._list("vms")
+
+    def list_running_vms(self) -> Generator[VirtualMachine, None, None]:
+        """List online VMs, which includes paused and teleporting ones too."""
+        yield from self._list("runningvms")
+
+    def _list(self, kind: str) -> Generator[VirtualMachine, None, None]:
+        result = self.run("list", kind)
         assert result.returncode == 0, result.returncode
 
-        for line in result.stdout.decode().splitlines():
-            match = re.match(r'"(.+)" {(.+)}', line)
-            if match:
-                name, id = match.groups()
-                yield VirtualMachine(self, id, name)
+        for match in _VM_LINE_RE.finditer(result.stdout):
+            name, id = match.groups()
+            yield VirtualMachine(self, id.decode(), name.decode())
 
     def get_running_machines(self) -> list[VirtualMachine]:
-        return [vm for vm in self.list_vm() if vm.info.state == VMState.Running]
+        """Return online VMs as listed by `VBoxManage list runningvms`.
+
+        Besides running machines this includes paused and teleporting ones,
+        check `VirtualMachineInfo.is_running` for strictly running state.
+        """
+        return list(self.list_running_vms())
 
     def metrics_enable(self) -> None:
         self.run("metrics", "enable")
@@ -237,6 +335,25 @@ class VBoxManage:
             *selectors,
         )
 
+    def poll_all_metrics(self) -> dict[str, dict[Metrics, str]]:
+        """Query all metrics of all objects with single VBoxManage call.
+
+        Returns raw metric values keyed by object (virtual machine) name.
+        """
+        result = self.run(
+            "metrics", "query", "*", ",".join(metric.value for metric in Metrics)
+        )
+        values: dict[str, dict[Metrics, str]] = {}
+
+        for match in _METRIC_QUERY_LINE_RE.finditer(result.stdout):
+            object_values = values.setdefault(match["object"].decode(), {})
+            if match["value"]:
+                # Rows without value are left out, so callers use "nan".
+                metric = Metrics(match["metric"].decode())
+                object_values[metric] = match["value"].decode()
+
+        return values
+
     def metrics_collect(self) -> None:
         with suppress(subprocess.TimeoutExpired):
             self.run("metrics", "collect", capture_output=True, timeout=1)
@@ -245,18 +362,39 @@ class VBoxManage:
 T = TypeVar("T")
 
 
-@contextmanager
-def log_error() -> Generator[None, None, None]:
-    try:
-        yield
-    except Exception as e:
-        print(f"Error: {e!r}")
-        raise
+class MetricRing:
+    """Fixed size history of all `Metrics` of one virtual machine.
+
+    Samples are stored unboxed in `array("d")` series sharing a write cursor,
+    which points at the oldest sample.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._series = {metric: array("d", [float("nan")]) * size for metric in Metrics}
+        self._position = 0
+        # Appended to from the metric daemon thread, read from Streamlit.
+        self._lock = threading.Lock()
+
+    def append(self, values: dict[Metrics, float]) -> None:
+        with self._lock:
+            for metric, series in self._series.items():
+                series[self._position] = values.get(metric, float("nan"))
+            self._position = (self._position + 1) % self.size
+
+    def history(self, metric: Metrics) -> array[float]:
+        """Return copy of samples of given metric, oldest first.
+
+        Kept as `array("d")`, so consumers can read it without reboxing floats.
+        """
+        with self._lock:
+            series = self._series[metric]
+            return series[self._position :] + series[: self._position]
 
 
 class VboxMetricDaemon:
 
-    metrics: dict[str, dict[str | Metrics, list[float]]]
+    metrics: dict[str, MetricRing]
 
     def __init__(self, vbox: VBoxManage, interval_seconds: float = 0.2) -> None:
         self.vbox = vbox
@@ -264,35 +402,43 @@ class VboxMetricDaemon:
         self.interval_seconds = interval_seconds
         self.tick_number = 120
 
+        # Time stamps are relative to the newest sample, so a single series
+        # is shared by all virtual machines. Evenly spaced from
+        # -(tick_number * interval_seconds) to 0 inclusive.
+        start = -(self.tick_number * self.interval_seconds)
+        step = -start / (self.tick_number - 1)
+        self.time_stamps = array(
+            "d", (start + index * step for index in range(self.tick_number))
+        )
+
+        # Metric collection is a persistent VirtualBox setting, enable it once.
+        self.vbox.metrics_enable()
+
         self.metrics = {}
-        self._refresh_metrics_storage()
+        self._last_vm_ids: frozenset[str] | None = None
+        self._last_running_vm_ids: frozenset[str] | None = None
+        self._refresh_metrics_storage(list(self.vbox.list_vm()))
+        self._refresh_metrics_setup()
 
         self.metric_query_thread = threading.Thread(target=self._query_metrics)
         self.metric_query_thread.start()
 
-    def _refresh_metrics_storage(self) -> None:
-        virtual_machines = self.vbox.list_vm()
+    def _refresh_metrics_setup(self) -> None:
+        """Set up metric collection when the set of running machines changes.
 
-        time_stamps = [
-            float(value)
-            for value in numpy.linspace(
-                -(self.tick_number * self.interval_seconds),
-                0,
-                self.tick_number,
-            )
-        ]
+        VirtualBox only applies setup to running machines and drops it on
+        shutdown, so machines started later need it again.
+        """
+        running_vm_ids = frozenset(vm.id for vm in self.vbox.list_running_vms())
+        if running_vm_ids != self._last_running_vm_ids:
+            self.vbox.metrics_setup(self.interval_seconds, 1, "*")
+            self._last_running_vm_ids = running_vm_ids
 
+    def _refresh_metrics_storage(self, virtual_machines: list[VirtualMachine]) -> None:
+        self._last_vm_ids = frozenset(vm.id for vm in virtual_machines)
         self.metrics = {
             vm.id: (
-                {
-                    Metrics.GUEST_CPU_LOAD_KERNEL: [float("nan")] * self.tick_number,
-                    Metrics.GUEST_CPU_LOAD_USER: [float("nan")] * self.tick_number,
-                    Metrics.GUEST_RAM_USAGE_TOTAL: [float("nan")] * self.tick_number,
-                    Metrics.GUEST_RAM_USAGE_FREE: [float("nan")] * self.tick_number,
-                    Metrics.DISK_USAGE_USED: [float("nan")] * self.tick_number,
-                    Metrics.GUEST_RAM_USAGE_CACHE: [float("nan")] * self.tick_number,
-                    "time_stamp": time_stamps,
-                }
+                MetricRing(self.tick_number)
                 if vm.id not in self.metrics
                 else self.metrics[vm.id]
             )
@@ -300,88 +446,81 @@ class VboxMetricDaemon:
         }
 
     def _query_metrics(self) -> None:
+        deadline = time.monotonic()
+
         while self.keep_alive:
-            self.vbox.metrics_enable()
+            # Schedule against fixed deadlines, so that time spent querying
+            # VBoxManage does not stretch the sampling interval.
+            deadline += self.interval_seconds
             self.vbox.metrics_collect()
 
-            self._refresh_metrics_storage()
-
-            for vm in self.vbox.list_vm():
-                self.vbox.metrics_setup(self.interval_seconds, 1, vm.id)
-
-                vm_metric_data = self.metrics.get(vm.id, {})
-
-                with log_error():
-                    vm_metric_data[Metrics.GUEST_CPU_LOAD_KERNEL].append(
-                        vm.query_metric(
-                            Metrics.GUEST_CPU_LOAD_KERNEL.value, parse_percent
-                        ),
-                    )
-                    vm_metric_data[Metrics.GUEST_CPU_LOAD_KERNEL].pop(0)
-
-                with log_error():
-                    vm_metric_data[Metrics.GUEST_CPU_LOAD_USER].append(
-                        vm.query_metric(
-                            Metrics.GUEST_CPU_LOAD_USER.value, parse_percent
-                        ),
-                    )
-                    vm_metric_data[Metrics.GUEST_CPU_LOAD_USER].pop(0)
-
-                with log_error():
-                    vm_metric_data[Metrics.GUEST_RAM_USAGE_TOTAL].append(
-                        vm.query_metric(
-                            Metrics.GUEST_RAM_USAGE_TOTAL.value, parse_bytes
-                        ),
-                    )
-                    vm_metric_data[Metrics.GUEST_RAM_USAGE_TOTAL].pop(0)
-
-                with log_error():
-                    vm_metric_data[Metrics.GUEST_RAM_USAGE_FREE].append(
-                        vm.query_metric(
-                            Metrics.GUEST_RAM_USAGE_FREE.value, parse_bytes
-                        ),
-                    )
-                    vm_metric_data[Metrics.GUEST_RAM_USAGE_FREE].pop(0)
-
-                with log_error():
-                    vm_metric_data[Metrics.DISK_USAGE_USED].append(
-                        vm.query_metric(Metrics.DISK_USAGE_USED.value, parse_bytes),
-                    )
-                    vm_metric_data[Metrics.DISK_USAGE_USED].pop(0)
-
-                with log_error():
-                    vm_metric_data[Metrics.GUEST_RAM_USAGE_CACHE].append(
-                        vm.query_metric(
-                            Metrics.GUEST_RAM_USAGE_CACHE.value, parse_bytes
-                        ),
-                    )
-                    vm_metric_data[Metrics.GUEST_RAM_USAGE_CACHE].pop(0)
-
-                self.metrics[vm.id] = vm_metric_data
-
-            time.sleep(self.interval_seconds)
+            virtual_machines = list(self.vbox.list_vm())
+            if frozenset(vm.id for vm in virtual_machines) != self._last_vm_ids:
+                self._refresh_metrics_storage(virtual_machines)
+            self._refresh_metrics_setup()
+
+            metric_values = self.vbox.poll_all_metrics()
+
+            for vm in virtual_machines:
+                vm_metric_values = metric_values.get(vm.name, {})
+
+                try:
+                    samples = {
+                        metric: parser(vm_metric_values.get(metric, "nan"))
+                        for metric, parser in METRIC_PARSERS.items()
+                    }
+                except Exception as e:
+                    # Skip this sample, but keep the daemon thread alive.
+                    print(f"Error: {e!r}")
+                    continue
+
+                self.metrics[vm.id].append(samples)
+
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+            else:
+                # Tick overran, start counting again instead of bursting.
+                deadline = now
 
     def get_metric_history(
         self, vm: VirtualMachine, metric: Metrics | Literal["time_stamp"]
-    ) -> list[float]:
-        return self.metrics.get(vm.id, {}).get(
-            metric, [float("nan")] * self.tick_number
-        )
+    ) -> array[float]:
+        if metric == "time_stamp":
+            return self.time_stamps[:]
+
+        ring = self.metrics.get(vm.id)
+        if ring is None:
+            return array("d", [float("nan")]) * self.tick_number
+        return ring.history(metric)
 
 
 def parse_percent(string) -> float:
     return float(string.strip("%"))
 
 
+_BYTE_UNIT_MULTIPLIERS = {
+    "b": 1,
+    "kb": 1024,
+    "mb": 1024 * 1024,
+    "gb": 1024 * 1024 * 1024,
+}
+
+
 def parse_bytes(string: str) -> float:
-    string = string.strip().casefold()
-    if string.endswith(" b"):
-        return float(string.rstrip("b"))
-    if string.endswith(" kb"):
-        return float(string.rstrip("kb")) * 1024
-    if string.endswith(" mb"):
-        return float(string.rstrip("mb")) * 1024 * 1024
-    if string.endswith(" gb"):
-        return float(string.rstrip("gb")) * 1024 * 1024 * 1024
-
-    return float(string)
+    number, _, unit = string.strip().casefold().rpartition(" ")
+    multiplier = _BYTE_UNIT_MULTIPLIERS.get(unit)
+    if not number or multiplier is None:
+        return float(string)
+
+    return float(number) * multiplier
+
+
+METRIC_PARSERS: dict[Metrics, Callable[[str], float]] = {
+    Metrics.GUEST_CPU_LOAD_KERNEL: parse_percent,
+    Metrics.GUEST_CPU_LOAD_USER: parse_percent,
+    Metrics.GUEST_RAM_USAGE_TOTAL: parse_bytes,
+    Metrics.GUEST_RAM_USAGE_FREE: parse_bytes,
+    Metrics.DISK_USAGE_USED: parse_bytes,
+    Metrics.GUEST_RAM_USAGE_CACHE: parse_bytes,
+}